@@ -0,0 +1,20 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True, language_level=3
+
+# Native fallback for generate_static_map when Numba isn't installed.
+# Same contract as the Numba kernel: table[c, (slot << 8) | v] holds
+# channel c of that slot's fill blended over base value v.
+
+cpdef void blend_regions(
+    const unsigned char[:, ::1] slots,
+    const unsigned char[:, ::1] table,
+    unsigned char[:, :, ::1] base,
+) noexcept nogil:
+    cdef Py_ssize_t y, x, c
+    cdef Py_ssize_t row
+    for y in range(slots.shape[0]):
+        for x in range(slots.shape[1]):
+            if slots[y, x] == 0:
+                continue
+            row = slots[y, x] << 8
+            for c in range(3):
+                base[y, x, c] = table[c, row | base[y, x, c]]
@@ -1,7 +1,42 @@
 from PIL import Image, ImageDraw, ImageFont
+import numpy as np
 import os
 from datetime import datetime
+import functools
+import hashlib
+import json
 import subprocess
+import tempfile
+
+try:
+    import imagecodecs
+except ImportError:
+    imagecodecs = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Compiled-on-import Cython kernel for hosts without Numba
+_overlay = None
+if numba is None:
+    try:
+        import pyximport
+        pyximport.install(language_level=3)
+        import _overlay
+    except ImportError:
+        _overlay = None
+
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 # ---------------- SETTINGS ----------------
 
@@ -13,6 +48,17 @@ COLORED_MAP_PATH = "PvM_kingdom_w22.png"
 
 OUTPUT_PATH = "pvm_static_output.png"
 
+# zlib level for the output PNG. 1 encodes several times faster than the
+# default 6 for a slightly larger file; raise it if size matters more.
+PNG_COMPRESS_LEVEL = 1
+
+# Decoded map arrays. The manifest records which source PNGs (path, size,
+# mtime) and region colours they were built from; any difference rebuilds.
+CACHE_DIR = "cache"
+CACHED_SLOTS_PATH = os.path.join(CACHE_DIR, "region_slots.npy")
+CACHED_BASE_PATH = os.path.join(CACHE_DIR, "base_rgb.npy")
+CACHE_MANIFEST_PATH = os.path.join(CACHE_DIR, "manifest.json")
+
 REGION_NAMES = [
     "Kourend",
     "Varlamore",
@@ -58,6 +104,7 @@ TEAM_FILL = {
 
 # ---------------- FONT LOADER ----------------
 
+@functools.lru_cache(maxsize=32)
 def load_font(size: int):
     if os.path.exists(OSRS_FONT_PATH):
         try:
@@ -85,6 +132,10 @@ def text_size(draw: ImageDraw.ImageDraw, text: str, font):
     bbox = draw.textbbox((0, 0), text, font=font)
     return bbox[2] - bbox[0], bbox[3] - bbox[1]
 
+def text_width(draw: ImageDraw.ImageDraw, text: str, font):
+    # Advance width only; cheaper than a full textbbox when centring
+    return draw.textlength(text, font=font)
+
 # ---------------- FAKE DATA ----------------
 
 def get_example_region_totals():
@@ -101,57 +152,298 @@ def get_example_region_totals():
 
 # ---------------- UTILS ----------------
 
-def hex_to_rgb(h: str):
-    h = h.lstrip("#")
-    return (int(h[0:2], 16), int(h[2:4], 16), int(h[4:6], 16))
+def pack_rgb(arr: np.ndarray) -> np.ndarray:
+    # (H, W, 3) uint8 -> (H, W) uint32 keys of the form 0xRRGGBB
+    return (
+        (arr[..., 0].astype(np.uint32) << 16)
+        | (arr[..., 1].astype(np.uint32) << 8)
+        | arr[..., 2]
+    )
+
+def read_png_rgb(path: str) -> np.ndarray:
+    # libpng via imagecodecs hands back the pixel buffer directly; PIL is
+    # the fallback for anything that isn't plain 8-bit grey/RGB/RGBA
+    if imagecodecs is not None:
+        with open(path, "rb") as f:
+            arr = imagecodecs.png_decode(f.read())
+        if arr.dtype == np.uint8:
+            if arr.ndim == 2:
+                return np.dstack([arr, arr, arr])
+            if arr.shape[2] == 3:
+                return arr
+            if arr.shape[2] == 4:
+                return arr[..., :3]
+
+    # Only convert when needed; convert() always allocates a fresh copy
+    img = Image.open(path)
+    img.load()
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    return np.asarray(img)
+
+def write_png_rgb(path: str, arr: np.ndarray):
+    if imagecodecs is not None:
+        with open(path, "wb") as f:
+            f.write(imagecodecs.png_encode(arr, level=PNG_COMPRESS_LEVEL))
+        return
+
+    Image.fromarray(arr, "RGB").save(
+        path, format="PNG", compress_level=PNG_COMPRESS_LEVEL, optimize=False
+    )
+
+def blend_fill(rgb: np.ndarray, fill: np.ndarray) -> np.ndarray:
+    # "Over" blend of RGBA fill(s) onto opaque uint8 RGB, rounded the same
+    # way as Image.alpha_composite: t / 255 done as (t + (t >> 8)) >> 8
+    a = fill[..., 3:].astype(np.uint16)
+    t = rgb * (255 - a) + fill[..., :3] * a + 128
+    return ((t + (t >> 8)) >> 8).astype(np.uint8)
+
+def blend_table(fills: np.ndarray) -> np.ndarray:
+    # Every fill alpha is a per-slot constant, so the blend for each
+    # (slot, channel, base value) can be tabulated up front:
+    # table[c, (slot << 8) | v] is channel c of fill[slot] over value v.
+    # Slot 0 is fully transparent and maps every value to itself.
+    values = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+    blended = blend_fill(values[None], fills[:, None])
+    return np.ascontiguousarray(blended.transpose(2, 0, 1).reshape(3, -1))
+
+# ---------------- REGION KEYS ----------------
+
+# Packed 0xRRGGBB key of each region colour, aligned with REGION_NAMES
+REGION_KEYS = np.fromiter(
+    (int(REGION_HEX[name].lstrip("#"), 16) for name in REGION_NAMES),
+    dtype=np.uint32,
+    count=len(REGION_NAMES),
+)
+
+def region_slots(keys: np.ndarray) -> np.ndarray:
+    # (H, W) packed keys -> (H, W) uint8 1-based slot in REGION_NAMES,
+    # 0 for pixels outside every region. The map has tens of thousands of
+    # distinct colours (anti-aliased borders), so index its palette once
+    # and collapse every non-region entry onto slot 0.
+    palette, inverse = np.unique(keys.ravel(), return_inverse=True)
+
+    pos = np.minimum(np.searchsorted(palette, REGION_KEYS), len(palette) - 1)
+    found = palette[pos] == REGION_KEYS
+
+    palette_slots = np.zeros(len(palette), dtype=np.uint8)
+    palette_slots[pos[found]] = np.arange(1, len(REGION_KEYS) + 1)[found]
+
+    return palette_slots[inverse].reshape(keys.shape)
+
+# ---------------- NUMBA BLEND KERNEL ----------------
+
+if numba is not None:
+    @numba.njit(
+        "void(uint8[:, :], uint8[:, :], uint8[:, :, :])",
+        parallel=True,
+        cache=True,
+    )
+    def _blend_regions(slots, table, base):
+        # One pass over the map with rows split across threads, blending in
+        # place without the temporaries of the NumPy path
+        for y in numba.prange(slots.shape[0]):
+            for x in range(slots.shape[1]):
+                i = slots[y, x]
+                if i == 0:
+                    continue
+                row = np.int32(i) << 8
+                for c in range(3):
+                    base[y, x, c] = table[c, row | base[y, x, c]]
 
 # ---------------- IMAGE GENERATION ----------------
 
-def generate_static_map():
-    base = Image.open(BASE_MAP_PATH).convert("RGBA")
-    colored = Image.open(COLORED_MAP_PATH).convert("RGB")
+def _static_cache_manifest() -> dict:
+    sources = []
+    for path in (BASE_MAP_PATH, COLORED_MAP_PATH):
+        st = os.stat(path)
+        sources.append([os.path.abspath(path), st.st_size, st.st_mtime_ns])
+    return {"sources": sources, "region_keys": REGION_KEYS.tolist()}
+
+def _static_cache_is_fresh(manifest: dict) -> bool:
+    cached = (CACHED_SLOTS_PATH, CACHED_BASE_PATH, CACHE_MANIFEST_PATH)
+    if not all(os.path.exists(p) for p in cached):
+        return False
 
-    if base.size != colored.size:
+    try:
+        with open(CACHE_MANIFEST_PATH) as f:
+            return json.load(f) == manifest
+    except (OSError, ValueError):
+        return False
+
+# os.umask can only be read by setting it, so sample it once at import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _write_cache_file(path: str, write):
+    # Write to a temp file in CACHE_DIR and rename it into place, so a run
+    # killed mid-write never leaves a truncated file under the real name
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        # mkstemp creates 0600; match the umask-based mode open() would give
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def _build_static_cache(manifest: dict):
+    base_arr = read_png_rgb(BASE_MAP_PATH)
+    colored_arr = read_png_rgb(COLORED_MAP_PATH)
+
+    if base_arr.shape != colored_arr.shape:
         raise ValueError("Base and coloured maps must be same size")
 
-    width, height = base.size
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # The manifest is the commit marker: drop it before touching the arrays
+    # and write it back only once both are fully in place
+    if os.path.exists(CACHE_MANIFEST_PATH):
+        os.remove(CACHE_MANIFEST_PATH)
+
+    # The decoded buffers go straight to disk; nothing is copied until
+    # np.save writes them out
+    slots = region_slots(pack_rgb(colored_arr))
+    _write_cache_file(CACHED_SLOTS_PATH, lambda f: np.save(f, slots))
+    _write_cache_file(CACHED_BASE_PATH, lambda f: np.save(f, base_arr))
+    _write_cache_file(
+        CACHE_MANIFEST_PATH, lambda f: f.write(json.dumps(manifest).encode())
+    )
+
+def _load_static_cache():
+    # Copy-on-write maps: blending into the base only dirties private
+    # pages and never touches the cache files
+    return (
+        np.load(CACHED_SLOTS_PATH, mmap_mode="c"),
+        np.load(CACHED_BASE_PATH, mmap_mode="c"),
+    )
+
+def _prepare_static_assets():
+    manifest = _static_cache_manifest()
+
+    if _static_cache_is_fresh(manifest):
+        try:
+            return _load_static_cache()
+        except (OSError, ValueError):
+            pass  # truncated or corrupt cache file: rebuild it
+
+    _build_static_cache(manifest)
+    return _load_static_cache()
 
-    region_overlay = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    overlay_pixels = region_overlay.load()
-    colored_pixels = colored.load()
+def generate_static_map():
+    # Blend straight into the base map array instead of building an RGBA
+    # overlay and alpha-compositing it
+    slots, base_arr = _prepare_static_assets()
 
     data = get_example_region_totals()
 
-    color_to_fill = {}
-    for region, hex_color in REGION_HEX.items():
-        region_rgb = hex_to_rgb(hex_color)
+    # Slot 0 stays fully transparent for pixels outside every region
+    fills = np.zeros((len(REGION_NAMES) + 1, 4), dtype=np.uint8)
+    for slot, region in enumerate(REGION_NAMES, start=1):
         control = data.get(region, {}).get("control", "None")
-        color_to_fill[region_rgb] = TEAM_FILL.get(control, TEAM_FILL["None"])
-
-    for y in range(height):
-        for x in range(width):
-            c = colored_pixels[x, y]
-            if c in color_to_fill:
-                overlay_pixels[x, y] = color_to_fill[c]
-
-    combined = Image.alpha_composite(base, region_overlay)
-    final = combined.convert("RGB")
-    final.save(OUTPUT_PATH)
+        fills[slot] = TEAM_FILL.get(control, TEAM_FILL["None"])
+
+    table = blend_table(fills)
+    if numba is not None:
+        _blend_regions(slots, table, base_arr)
+    elif _overlay is not None:
+        _overlay.blend_regions(slots, table, base_arr)
+    else:
+        # Pure gathers on uint8/uint16 data: no masks, no float maths
+        rows = slots.astype(np.uint16) << 8
+        for c in range(3):
+            channel = base_arr[..., c]
+            channel[...] = np.take(table[c], rows | channel)
+
+    write_png_rgb(OUTPUT_PATH, base_arr)
 
     print(f"Generated: {OUTPUT_PATH}")
 
 # ---------------- GITHUB UPLOAD ----------------
 
-def upload_to_github():
-    try:
+UPLOAD_COMMIT_MESSAGE = "Auto-update PvM static map"
+
+# Digest of the last image pushed, so unchanged renders skip git entirely
+LAST_UPLOAD_HASH_PATH = ".last_upload_hash"
+
+def _output_digest() -> str:
+    with open(OUTPUT_PATH, "rb") as f:
+        content = f.read()
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(content)
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+def _git_signature(repo, role: str):
+    # Same precedence as git for the common cases: GIT_AUTHOR_* /
+    # GIT_COMMITTER_* env vars first, then user.name / user.email.
+    # Raises KeyError when libgit2 can't see an identity.
+    name = os.environ.get(f"GIT_{role}_NAME") or repo.config["user.name"]
+    email = os.environ.get(f"GIT_{role}_EMAIL") or repo.config["user.email"]
+    return pygit2.Signature(name, email)
+
+def _commit_output() -> bool:
+    # Stage and commit in-process when pygit2 is available; only the push
+    # needs a git subprocess. Returns False if the image is already
+    # committed (e.g. a previous run committed it but the push failed).
+    # The in-process commit does not run commit hooks or honour
+    # commit.gpgsign.
+    if pygit2 is None:
         subprocess.run(["git", "add", OUTPUT_PATH], check=True)
-        subprocess.run(
-            ["git", "commit", "-m", "Auto-update PvM static map"],
-            check=True
+        staged = subprocess.run(
+            ["git", "diff", "--cached", "--quiet", "--", OUTPUT_PATH]
         )
-        subprocess.run(["git", "push"], check=True)
+        if staged.returncode == 0:
+            return False
+        subprocess.run(["git", "commit", "-m", UPLOAD_COMMIT_MESSAGE], check=True)
+        return True
+
+    repo = pygit2.Repository(pygit2.discover_repository(os.getcwd()))
+    repo.index.add(os.path.relpath(os.path.abspath(OUTPUT_PATH), repo.workdir))
+    repo.index.write()
+    tree = repo.index.write_tree()
+
+    head = repo.head.peel(pygit2.Commit)
+    if tree == head.tree.id:
+        return False
+
+    try:
+        author = _git_signature(repo, "AUTHOR")
+        committer = _git_signature(repo, "COMMITTER")
+    except (KeyError, pygit2.GitError):
+        # No identity libgit2 can resolve; the index is already staged, so
+        # let git itself work out who is committing
+        subprocess.run(["git", "commit", "-m", UPLOAD_COMMIT_MESSAGE], check=True)
+        return True
+
+    repo.create_commit(
+        "HEAD", author, committer, UPLOAD_COMMIT_MESSAGE, tree, [head.id]
+    )
+    return True
+
+def upload_to_github():
+    git_errors = (subprocess.CalledProcessError,)
+    if pygit2 is not None:
+        git_errors += (pygit2.GitError,)
+
+    digest = _output_digest()
+    if os.path.exists(LAST_UPLOAD_HASH_PATH):
+        with open(LAST_UPLOAD_HASH_PATH) as f:
+            if f.read().strip() == digest:
+                print("Image unchanged, skipping upload.")
+                return
+
+    try:
+        if not _commit_output():
+            # The hash file is only written after a successful push, so a
+            # mismatch here means an earlier push never landed: retry it
+            print("Image already committed, pushing pending commits.")
+        subprocess.run(["git", "push", "--quiet"], check=True)
+        with open(LAST_UPLOAD_HASH_PATH, "w") as f:
+            f.write(digest)
         print("Uploaded image to GitHub.")
-    except subprocess.CalledProcessError as e:
+    except git_errors as e:
         print("Git upload failed:", e)
 
 # ---------------- MAIN ----------------